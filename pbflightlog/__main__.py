@@ -1,7 +1,7 @@
 """Tools for interacting with a local GeoPackage flight log."""
 
 # Project imports
-import pbflightlog.tools as flt
+import pbflightlog.cli as cli
 
 if __name__ == "__main__":
-    flt.main()
+    cli.main()
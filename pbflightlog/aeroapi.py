@@ -1,90 +1,198 @@
 """Tools for interacting with FlightAware's AeroAPI."""
 
 # Standard imports
+import json
+import math
 import os
+import re
 import sys
+import tempfile
+import threading
 import time
 from datetime import datetime, timedelta, timezone
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING
 from zoneinfo import ZoneInfo
 
 # Third-party imports
-import requests
-from dateutil.parser import isoparse
 from tabulate import tabulate
 
-# Load API key.
-_API_KEY = os.getenv("AEROAPI_API_KEY")
-if _API_KEY is None:
-    raise KeyError("Environment variable AEROAPI_API_KEY is missing.")
+if TYPE_CHECKING:
+    import requests
+
 # Server info.
 SERVER = "https://aeroapi.flightaware.com/aeroapi"
 _TIMEOUT = 10
 
+# Characters allowed in AeroAPI response cache keys.
+_CACHE_KEY_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
 class AeroAPIRateLimiter:
-    """Maintains state of wait time."""
+    """
+    Maintains state of wait time.
+
+    Requests are throttled with a token bucket: each request uses a
+    token, and tokens are refilled at one per wait time, up to the
+    burst size. Requests only wait when no token is available.
+    """
 
     def __init__(self):
         # Set a wait time in seconds to avoid rate limiting on the
         # Personal tier. If your account has a higher rate limit, you
         # can set this to 0.
         self.wait_time = 8
-        self.wait_until = datetime.now(timezone.utc)
+        # The burst size is read when the first request is made, so
+        # commands that don't call AeroAPI don't require it to be valid.
+        self.burst: float | None = None
+        self.tokens = 0
+        self.refilled_at = time.monotonic()
+        # Requests may be made from a worker thread.
+        self._lock = threading.Lock()
 
     def wait(self):
         """Delays requests to avoid AeroAPI rate limits."""
         if self.wait_time == 0:
             return
-        now = datetime.now(timezone.utc)
+        with self._lock:
+            if self.burst is None:
+                self.burst = self._burst_size()
+                self.tokens = self.burst
+                self.refilled_at = time.monotonic()
+            self._refill()
 
-        # If we're early, wait.
-        if now < self.wait_until:
-            sleep_seconds = (self.wait_until - now).total_seconds()
-            print(f"⏳ Waiting until {self.wait_until}")
-            time.sleep(sleep_seconds)
+            # If there are no tokens left, wait for the next one.
+            if self.tokens < 1:
+                sleep_seconds = (1 - self.tokens) * self.wait_time
+                wait_until = datetime.now(timezone.utc) + timedelta(
+                    seconds=sleep_seconds
+                )
+                print(f"⏳ Waiting until {wait_until}")
+                time.sleep(sleep_seconds)
+                self._refill()
 
-        # Schedule the next wait.
-        self.wait_until = datetime.now(timezone.utc) + timedelta(
-            seconds=self.wait_time
-        )
+            self.tokens = max(self.tokens - 1, 0)
+
+    def _refill(self):
+        """Adds tokens for the time elapsed since the last refill."""
+        now = time.monotonic()
+        elapsed = now - self.refilled_at
+        self.tokens = min(self.tokens + elapsed / self.wait_time, self.burst)
+        self.refilled_at = now
+
+    @staticmethod
+    def _burst_size() -> float:
+        """
+        Gets the number of AeroAPI requests allowed without waiting.
+
+        Defaults to 1, which spaces every request by the wait time.
+        """
+        burst_env = os.getenv("PBFLIGHTLOG_AEROAPI_BURST")
+        if burst_env is None:
+            return 1
+        try:
+            burst = float(burst_env)
+        except ValueError:
+            burst = 0
+        if not math.isfinite(burst) or burst < 1:
+            raise ValueError(
+                "Environment variable PBFLIGHTLOG_AEROAPI_BURST must be a "
+                "number greater than or equal to 1."
+            )
+        return burst
 
 _rate_limiter = AeroAPIRateLimiter()
 
+@cache
+def _get_session() -> requests.Session:
+    """
+    Gets the session for AeroAPI requests.
+
+    Reusing one session keeps the connection to the server open between
+    requests, and sends the API key with every request. Rate limited
+    and transient server errors are retried with exponential backoff.
+
+    The session (and the requests library) is only loaded when the
+    first request is made, so commands that don't call AeroAPI don't
+    pay for importing it.
+    """
+    # Third-party imports
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.headers.update({'x-apikey': _api_key()})
+    retries = Retry(
+        total=3,
+        backoff_factor=1.0,
+        status_forcelist=[429, 502, 503, 504],
+        raise_on_status=False,
+    )
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retries),
+    )
+    return session
+
 def get_flights_ident(ident, ident_type=None):
-    """Gets flights matching an ident."""
+    """
+    Gets flights matching an ident.
+
+    Lookups by fa_flight_id are cached (if a cache folder is set) once
+    all matching flights are complete.
+    """
     print(f"Looking up \"{ident}\" on AeroAPI")
+    cache_key = f"flights_{ident}" if ident_type == "fa_flight_id" else None
+    if cache_key is not None:
+        cached = _read_cache(cache_key)
+        if cached is not None:
+            return cached['flights']
     url = f"{SERVER}/flights/{ident}"
-    headers = {'x-apikey': _API_KEY}
     params = {'ident_type': ident_type}
     _rate_limiter.wait()
-    response = requests.get(
+    response = _get_session().get(
         url,
-        headers=headers,
         params=params,
         timeout=_TIMEOUT,
     )
     print(f"🌐 GET {response.url}")
     response.raise_for_status()
     fa_json = response.json()
+    if cache_key is not None and len(fa_json['flights']) > 0 and all(
+        f.get('progress_percent') == 100 for f in fa_json['flights']
+    ):
+        _write_cache(cache_key, fa_json)
     return fa_json['flights']
 
-def get_flights_ident_track(ident):
-    """Gets the track for a specific flight."""
+def get_flights_ident_track(ident, complete=False):
+    """
+    Gets the track for a specific flight.
+
+    Tracks of complete flights don't change, so they are cached (if a
+    cache folder is set) when complete is True.
+    """
+    cache_key = f"track_{ident}" if complete else None
+    if cache_key is not None:
+        cached = _read_cache(cache_key)
+        if cached is not None:
+            return cached
     url = f"{SERVER}/flights/{ident}/track"
-    headers = {'x-apikey': _API_KEY}
     params = {
         'include_estimated_positions': "true",
         'include_surface_positions': "true",
     }
     _rate_limiter.wait()
-    response = requests.get(
+    response = _get_session().get(
         url,
-        headers=headers,
         params=params,
         timeout=_TIMEOUT,
     )
     print(f"🌐 GET {response.url}")
     response.raise_for_status()
     fa_json = response.json()
+    if cache_key is not None:
+        _write_cache(cache_key, fa_json)
     return fa_json
 
 def select_flight_info(flight_info_flights: list[dict]) -> dict | None:
@@ -95,9 +203,14 @@ def select_flight_info(flight_info_flights: list[dict]) -> dict | None:
         return None
     if len(flight_info_flights) == 1:
         return flight_info_flights[0]
-    flight_info_flights = sorted(flight_info_flights, key=lambda f: (
-        f.get('scheduled_out') is None, f.get('scheduled_out')
-    ), reverse=True)
+    # Show the most recent flights first, followed by any flights without
+    # a scheduled departure.
+    scheduled = [f for f in flight_info_flights if f.get('scheduled_out')]
+    unscheduled = [
+        f for f in flight_info_flights if not f.get('scheduled_out')
+    ]
+    scheduled.sort(key=lambda f: f['scheduled_out'], reverse=True)
+    flight_info_flights = scheduled + unscheduled
     table = [
         [
             i + 1,
@@ -132,20 +245,108 @@ def select_flight_info(flight_info_flights: list[dict]) -> dict | None:
             return None
         try:
             row_index = int(row) - 1
-            if row_index < 0:
-                print("Invalid row selection.")
-                continue
-            selected_flight_info = flight_info_flights[row_index]
-        except IndexError, ValueError:
+        except ValueError:
             print("Invalid row selection.")
+            continue
+        if not 0 <= row_index < len(flight_info_flights):
+            print("Invalid row selection.")
+            continue
+        selected_flight_info = flight_info_flights[row_index]
     return selected_flight_info
 
+def _api_key() -> str:
+    """
+    Gets the AeroAPI key.
+
+    The key is looked up when a request is made rather than at import,
+    so that commands which don't call AeroAPI don't require it.
+    """
+    api_key = os.getenv("AEROAPI_API_KEY")
+    if api_key is None:
+        raise KeyError("Environment variable AEROAPI_API_KEY is missing.")
+    return api_key
+
+def _cache_folder() -> Path | None:
+    """Gets the AeroAPI response cache folder, if one is set."""
+    cache_folder_env = os.getenv("PBFLIGHTLOG_AEROAPI_CACHE_PATH")
+    if cache_folder_env is None:
+        return None
+    cache_folder = Path(cache_folder_env)
+    if not cache_folder.is_dir():
+        raise KeyError(
+            "Environment variable PBFLIGHTLOG_AEROAPI_CACHE_PATH is not a "
+            "directory."
+        )
+    return cache_folder
+
+def _cache_file(key: str) -> Path | None:
+    """
+    Gets the cache file for an AeroAPI response, if a cache folder is
+    set.
+
+    Keys include idents that may come from the command line, so only
+    letters, digits, hyphens, and underscores are allowed, to keep the
+    file inside the cache folder.
+    """
+    cache_folder = _cache_folder()
+    if cache_folder is None:
+        return None
+    if _CACHE_KEY_PATTERN.fullmatch(key) is None:
+        raise ValueError(
+            f"\"{key}\" can't be used as an AeroAPI cache key. Idents may "
+            "only contain letters, digits, hyphens, and underscores."
+        )
+    return cache_folder / f"{key}.json"
+
+def _read_cache(key: str) -> dict | None:
+    """Reads a cached AeroAPI response, if there is one."""
+    cache_file = _cache_file(key)
+    if cache_file is None:
+        return None
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            fa_json = json.load(f)
+    except FileNotFoundError, json.JSONDecodeError:
+        return None
+    print(f"💾 Loaded cached AeroAPI response from \"{cache_file}\"")
+    return fa_json
+
+def _write_cache(key: str, fa_json: dict) -> None:
+    """
+    Saves an AeroAPI response to the cache folder, if one is set.
+
+    The response is written to a temporary file that then replaces the
+    cache file, so an interrupted write never leaves a partial cache
+    file. If the write fails, a warning is printed and the response is
+    still used.
+    """
+    cache_file = _cache_file(key)
+    if cache_file is None:
+        return
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=cache_file.parent,
+            prefix=f"{cache_file.stem}.",
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            temp_path = Path(f.name)
+            json.dump(fa_json, f)
+        os.replace(temp_path, cache_file)
+    except OSError as e:
+        print(f"⚠️ Could not cache AeroAPI response: {e}")
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+
 def _dt_str_tz(dt_str, tz):
     """Converts a datetime into local time."""
     if dt_str is None or tz is None:
         return None
     try:
-        dt = isoparse(dt_str)
+        dt = datetime.fromisoformat(dt_str)
         dt_tz = dt.astimezone(ZoneInfo(tz))
     except ValueError:
         return None
@@ -3,14 +3,84 @@
 # Standard imports
 import calendar
 import json
+import re
 import sys
-from datetime import datetime, date, timedelta
+from dataclasses import dataclass, field
+from datetime import datetime, date, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from zoneinfo import ZoneInfo
+from typing import NamedTuple
 from zipfile import ZipFile
 
-# Third-party imports
-from dateutil.parser import isoparse
+class _Field(NamedTuple):
+    """A fixed-width field in a BCBP block."""
+    key: str
+    length: int
+
+# Fields of the Mandatory Repeated block, in order.
+_MAND_REPT_LAYOUT = (
+    _Field('pnr_code', 7),
+    _Field('from_airport', 3),
+    _Field('to_airport', 3),
+    _Field('operating_carrier', 3),
+    _Field('flight_number', 5),
+    _Field('date_of_flight', 3),
+    _Field('compartment_code', 1),
+    _Field('seat_number', 4),
+    _Field('check_in_sequence_number', 5),
+    _Field('passenger_status', 1),
+    _Field('conditional_airline_size', 2),
+)
+
+# Matches the Mandatory Repeated block, with a named group per field.
+_MAND_REPT_PATTERN = re.compile(
+    "".join(f"(?P<{f.key}>.{{{f.length}}})" for f in _MAND_REPT_LAYOUT),
+    re.DOTALL,
+)
+_MAND_REPT_SIZE = sum(f.length for f in _MAND_REPT_LAYOUT)
+
+# Values of two-digit hexadecimal strings, which BCBP uses for the
+# sizes of variable-length blocks.
+_HEX_PAIRS = {f"{i:02{case}}": i for i in range(256) for case in "xX"}
+
+# Shows spaces in BCBP text as middle dots.
+_VISIBLE_SPACES = str.maketrans({" ": "·"})
+
+@dataclass(slots=True)
+class _UniqueBlocks:
+    """Locations of the blocks that appear once in a BCBP."""
+    mandatory: slice = slice(0, 23) # Always here
+    conditional: slice | None = None
+    security: slice | None = None
+
+@dataclass(slots=True)
+class _LegBlocks:
+    """Locations of the blocks that repeat for each leg of a BCBP."""
+    mandatory: slice | None = None
+    conditional: slice | None = None
+    airline: slice | None = None
+
+@dataclass(slots=True)
+class _Blocks:
+    """Locations of all blocks in a BCBP."""
+    unique: _UniqueBlocks = field(default_factory=_UniqueBlocks)
+    repeated: list[_LegBlocks] = field(default_factory=list)
+
+    def prev_leg_stop(self, leg_index: int) -> int:
+        """Gets the index of the stop of the previous leg."""
+        if leg_index == 0:
+            # Use end of mandatory unique block.
+            return self.unique.mandatory.stop
+        prev_leg = self.repeated[leg_index - 1]
+        if prev_leg.airline is not None:
+            return prev_leg.airline.stop
+        if prev_leg.conditional is not None:
+            return prev_leg.conditional.stop
+        if leg_index == 1:
+            # Second leg might start at end of Unique Conditional.
+            if self.unique.conditional is not None:
+                return self.unique.conditional.stop
+        return prev_leg.mandatory.stop
 
 class BoardingPass():
     """
@@ -19,18 +89,21 @@ class BoardingPass():
     This class only encodes data that the flight log uses. Many IATA
     BCBP fields are intentionally excluded.
     """
+    __slots__ = (
+        'bcbp_str', 'valid', 'pass_dt', '_leg_count', '_blocks', 'legs',
+    )
+
     def __init__(self, bcbp_str: str, pass_dt:datetime=None):
+        valid, leg_count, blocks = _calculate_blocks(bcbp_str)
         self.bcbp_str: str = bcbp_str
-        self.valid: bool = True
+        self.valid: bool = valid
         self.pass_dt: datetime | None = pass_dt
-        self._data_len: int = len(self.bcbp_str)
-        self._leg_count: int = 0
-        self._blocks: dict | None = None
-        self._calculate_blocks()
+        self._leg_count: int = leg_count
+        self._blocks: _Blocks | None = blocks
         self.legs: list(Leg) = self._legs()
 
     def __str__(self):
-        return self.bcbp_str.replace(" ", "·")
+        return self.bcbp_str.translate(_VISIBLE_SPACES)
 
     def select_leg(self) -> Leg:
         """
@@ -56,165 +129,43 @@ class BoardingPass():
             except IndexError, ValueError:
                 print("Invalid leg number.")
 
-    def _calculate_blocks(self) -> None:
-        """
-        Calculates block locations in the BCBP text.
-
-        Sets self._blocks to a dict with values containing slices of the
-        start and stop character indexes in the BCBP text for each
-        block. Blocks that are not present store a value of None instead
-        of a slice.
-        """
-        if len(self.bcbp_str) < 60:
-            self.valid = False
-            return None
-        # Get number of legs.
-        try:
-            self._leg_count = int(self.bcbp_str[1:2])
-            if self._leg_count < 1 or self._leg_count > 4:
-                self.valid = False
-                return None
-        except ValueError:
-            self.valid = False
-            return None
-
-        # Initialize blocks.
-        self._blocks = {
-            'unique': {
-                'mandatory': slice(0, 23), # Always here
-                'conditional': None,
-                'security': None,
-            },
-            'repeated': []
-        }
-
-        # Loop through legs.
-        for leg_index in range(self._leg_count):
-            self._blocks['repeated'].append({
-                'mandatory': None,
-                'conditional': None,
-                'airline': None,
-            })
-
-            # Mandatory Repeated block
-            mand_rept_start = self._prev_leg_stop(leg_index)
-            mand_rept_stop = mand_rept_start + 37 # Always 37 characters
-            if mand_rept_stop > self._data_len:
-                self.valid = False
-                return
-            self._blocks['repeated'][leg_index]['mandatory'] = slice(
-                mand_rept_start, mand_rept_stop
-            )
-            cond_airline_size = _parse_hex(
-                self.bcbp_str[mand_rept_stop - 2:mand_rept_stop])
-            if cond_airline_size is None:
-                self.valid = False
-                return
-            if cond_airline_size == 0:
-                # No conditional or airline items.
-                continue
-            leg_stop = mand_rept_stop + cond_airline_size
-            if leg_stop > self._data_len:
-                self.valid = False
-                return
-
-            # Conditional Unique block (first leg only)
-            if leg_index == 0:
-                if cond_airline_size < 4:
-                    # Conditional Unique not big enough to contain size
-                    # field
-                    self._blocks['unique']['conditional'] = slice(
-                        mand_rept_stop, mand_rept_start + cond_airline_size
-                    )
-                    continue
-                cond_uniq_size = _parse_hex(
-                    self.bcbp_str[mand_rept_stop + 2:mand_rept_stop + 4]
-                )
-                if cond_uniq_size is None:
-                    self.valid = False
-                    return
-                cond_rept_start = mand_rept_stop + 4 + cond_uniq_size
-                if cond_rept_start > self._data_len:
-                    self.valid = False
-                    return
-                self._blocks['unique']['conditional'] = slice(
-                    mand_rept_stop, cond_rept_start
-                )
-            else:
-                cond_rept_start = mand_rept_stop
-
-            # Conditional Repeated block
-            if cond_rept_start == leg_stop:
-                # No more data.
-                continue
-            if cond_rept_start + 2 > leg_stop:
-                # Conditional not big enough to contain Conditional
-                # Repeated size field.
-                self._blocks['repeated'][leg_index]['conditional'] = slice(
-                    cond_rept_start, leg_stop
-                )
-            cond_rept_size = _parse_hex(
-                self.bcbp_str[cond_rept_start:cond_rept_start + 2]
-            )
-            if cond_rept_size is None:
-                self.valid = False
-                return
-            cond_rept_stop = cond_rept_start + 2 + cond_rept_size
-            if cond_rept_stop > self._data_len:
-                self.valid = False
-                return
-            self._blocks['repeated'][leg_index]['conditional'] = slice(
-                cond_rept_start, cond_rept_stop
-            )
-
-            # Airline Repeated block
-            if cond_rept_stop == leg_stop:
-                # No more data.
-                continue
-            self._blocks['repeated'][leg_index]['airline'] = slice(
-                cond_rept_stop, leg_stop
-            )
-
-        # Security block
-        security_start = self._prev_leg_stop(self._leg_count)
-        if security_start < self._data_len:
-            self._blocks['unique']['security'] = slice(
-                security_start, self._data_len
-            )
-
     def _legs(self) -> list(Leg):
         """Returns Leg objects for each leg."""
+        if not self.valid:
+            # Blocks may be missing, or only located for some legs.
+            return []
+        latest_date = None
+        if self.pass_dt is None:
+            latest_date = _latest_flight_date()
         return [
-            Leg(self.bcbp_str, self._blocks['repeated'][i], self.pass_dt)
+            Leg(
+                self.bcbp_str,
+                self._blocks.repeated[i],
+                self.pass_dt,
+                latest_date=latest_date,
+            )
             for i in range(self._leg_count)
         ]
 
-    def _prev_leg_stop(self, leg_index):
-        """Gets the index of the stop of the previous leg."""
-        if leg_index == 0:
-            # Use end of mandatory unique block.
-            return self._blocks['unique']['mandatory'].stop
-        prev_leg = self._blocks['repeated'][leg_index - 1]
-        if prev_leg['airline'] is not None:
-            return prev_leg['airline'].stop
-        if prev_leg['conditional'] is not None:
-            return prev_leg['conditional'].stop
-        if leg_index == 1:
-            # Second leg might start at end of Unique Conditional.
-            if self._blocks['unique']['conditional'] is not None:
-                return self._blocks['unique']['conditional'].stop
-        return prev_leg['mandatory'].stop
-
-
 class Leg():
     """Represents one flight leg of a boarding pass."""
+    __slots__ = (
+        'bcbp_str', '_blocks', '_pass_dt', '_latest_date', '_mandatory',
+        'flight_date', 'airline_iata', 'flight_number', 'origin_iata',
+        'destination_iata',
+    )
 
     def __init__(self,
-        bcbp_text: str, leg_blocks: dict, pass_dt: datetime | None = None
+        bcbp_text: str,
+        leg_blocks: _LegBlocks,
+        pass_dt: datetime | None = None,
+        latest_date: date | None = None,
     ):
         self.bcbp_str: str = bcbp_text
-        self._blocks: dict = leg_blocks
+        self._blocks: _LegBlocks = leg_blocks
         self._pass_dt: datetime | None = pass_dt
+        self._latest_date: date | None = latest_date
+        self._mandatory: dict[str, str] = self._match_mandatory()
         self.flight_date: date | None = self._parse_flight_date()
         self.airline_iata: str | None = self._parse_airline_iata()
         self.flight_number: str | None = self._parse_flight_number()
@@ -233,65 +184,63 @@ class Leg():
             f"{self.origin_iata} → {self.destination_iata}"
         )
 
+    def _match_mandatory(self) -> dict[str, str]:
+        """Splits the Mandatory Repeated block into its fields."""
+        block = self._blocks.mandatory
+        if block is None:
+            return {}
+        match = _MAND_REPT_PATTERN.match(
+            self.bcbp_str, block.start, block.stop
+        )
+        if match is None:
+            return {}
+        return match.groupdict()
+
     def _parse_airline_iata(self) -> str | None:
         """Parses airline IATA code."""
-        raw = _get_raw(
-            self.bcbp_str, self._blocks['mandatory'], slice(13, 16)
-        )
+        raw = self._mandatory.get('operating_carrier')
         if raw is None:
             return None
-        return raw.strip()
+        return sys.intern(raw.strip())
 
     def _parse_airport_dest_iata(self) -> str | None:
         """Parses destination airport IATA code."""
-        raw = _get_raw(
-            self.bcbp_str, self._blocks['mandatory'], slice(10, 13)
-        )
+        raw = self._mandatory.get('to_airport')
         if raw is None:
             return None
-        return raw.strip()
+        return sys.intern(raw.strip())
 
     def _parse_airport_orig_iata(self) -> str | None:
         """Parses origin airport IATA code."""
-        raw = _get_raw(
-            self.bcbp_str, self._blocks['mandatory'], slice(7, 10)
-        )
+        raw = self._mandatory.get('from_airport')
         if raw is None:
             return None
-        return raw.strip()
+        return sys.intern(raw.strip())
 
     def _parse_flight_date(self) -> date | None:
         """Parses flight date."""
-        raw = _get_raw(
-            self.bcbp_str, self._blocks['mandatory'], slice(21, 24)
-        )
-        try:
-            day_of_year: int = int(raw)
-            if day_of_year > 366 or day_of_year < 1:
-                return None
-        except TypeError, ValueError:
+        raw = self._mandatory.get('date_of_flight')
+        if raw is None or not raw.strip().isdecimal():
+            return None
+        day_of_year: int = int(raw)
+        if day_of_year > 366 or day_of_year < 1:
             return None
         if self._pass_dt is None:
             # Assume flight is up to 3 days in the future, or else the
             # most recent date matching this ordinal in the past.
-            latest_dt = datetime.now() + timedelta(days=3)
-            latest_dt_year = latest_dt.timetuple().tm_year
-            latest_date = latest_dt.date()
-            # Loop through years in reverse trying to find a good date.
-            # Searches 8 years since leap years can be up to 8 years apart.
-            for year in range(latest_dt_year, latest_dt_year-8, -1):
-                test_date = _ordinal_date(year, day_of_year)
-                if test_date is None or test_date.year != year:
-                    # The ordinal was larger than the number of days
-                    # this year, probably due to no leap year.
-                    continue
-                if test_date > latest_date:
-                    # The date this year is more than three days in the
-                    # future.
-                    continue
-                # This is the most recent date that works.
-                return test_date
-            return None
+            latest_date = self._latest_date or _latest_flight_date()
+            year = latest_date.year
+            test_date = _ordinal_date(year, day_of_year)
+            if test_date is None or test_date > latest_date:
+                # The date this year doesn't exist (no leap year) or is
+                # more than three days in the future.
+                year -= 1
+            if day_of_year == 366:
+                # Find the most recent leap year. Leap years can be up
+                # to 8 years apart.
+                while not calendar.isleap(year):
+                    year -= 1
+            return _ordinal_date(year, day_of_year)
 
         # Use pass_dt to figure out the year.
         # Because the timezone of the departure airport is not known,
@@ -299,7 +248,16 @@ class Leg():
         # could potentially be the year before or after the UTC
         # pass_dt's year. Look at all three years and see which date is
         # closest to pass_dt.
-        utc_year = self._pass_dt.year
+        pass_date = self._pass_dt.date()
+        utc_year = pass_date.year
+        same_year_date = _ordinal_date(utc_year, day_of_year)
+        if (
+            same_year_date is not None
+            and abs((same_year_date - pass_date).days) <= 182
+        ):
+            # Dates in the adjacent years are at least 365 days from
+            # this one, so they can't be any closer to pass_dt.
+            return same_year_date
         years = [utc_year - 1, utc_year, utc_year + 1]
         if day_of_year == 366:
             # Eliminate non-leap-years.
@@ -307,25 +265,16 @@ class Leg():
             if len(years) == 0:
                 # No adjacent year is a leap year.
                 return None
-        # Create dates to check.
+        # Get date with smallest difference from the pass date.
         dates = [_ordinal_date(y, day_of_year) for y in years]
-        # Create a dictionary of date indexes and their differences from
-        # the pass date.
-        date_diffs = {
-            i: abs(d - self._pass_dt.date())
-            for i, d in enumerate(dates)
-        }
-        # Get date with smallest difference.
-        return dates[min(date_diffs, key=date_diffs.get)]
+        return min(dates, key=lambda d: abs(d - pass_date))
 
     def _parse_flight_number(self) -> str | None:
         """Parses flight number."""
-        raw = _get_raw(
-            self.bcbp_str, self._blocks['mandatory'], slice(16, 21)
-        )
+        raw = self._mandatory.get('flight_number')
         if raw is None:
             return None
-        return raw.strip().lstrip("0") or "0"
+        return _clean_flight_number(raw)
 
 
 class PKPass():
@@ -371,27 +320,156 @@ class PKPass():
                 print(f"{PKPass.PASS_FILE} not found in {path}.")
                 return {}
             with zf.open(PKPass.PASS_FILE) as pf:
-                return json.loads(pf.read().decode('utf-8'))
+                return json.load(pf)
 
     def _parse_relevant_date(self) -> datetime | None:
         """Gets the PKPass date."""
         try:
-            pass_date = isoparse(self.pass_json.get('relevantDate'))
-            return pass_date.astimezone(ZoneInfo("UTC"))
+            pass_date = datetime.fromisoformat(
+                self.pass_json.get('relevantDate')
+            )
+            return pass_date.astimezone(timezone.utc)
         except TypeError, ValueError:
             return None
 
-def _get_raw(bcbp_str, block_slice, field_slice):
-    """Gets raw values for a field."""
-    if block_slice is None:
-        return None
-    chars = slice(
-        block_slice.start + field_slice.start,
-        block_slice.start + field_slice.stop,
-    )
-    if chars.stop > block_slice.stop:
-        return None
-    return bcbp_str[chars]
+@lru_cache(maxsize=256)
+def _calculate_blocks(bcbp_str: str) -> tuple[bool, int, _Blocks | None]:
+    """
+    Calculates block locations in the BCBP text.
+
+    Returns whether the text is valid, the number of legs, and a _Blocks
+    with slices of the start and stop character indexes in the BCBP text
+    for each block. Blocks that are not present store a value of None
+    instead of a slice.
+
+    Results are cached by BCBP text, so the returned _Blocks may be
+    shared between passes and must not be modified.
+    """
+    data_len = len(bcbp_str)
+    if data_len < 60:
+        return False, 0, None
+    # Get number of legs.
+    leg_count_str = bcbp_str[1]
+    if not leg_count_str.isdecimal():
+        return False, 0, None
+    leg_count = int(leg_count_str)
+    if leg_count < 1 or leg_count > 4:
+        return False, leg_count, None
+    if (
+        leg_count == 1
+        and data_len == 23 + _MAND_REPT_SIZE
+        and bcbp_str[data_len - 2:] == "00"
+    ):
+        # Single leg with only mandatory items.
+        return True, leg_count, _Blocks(
+            repeated=[_LegBlocks(mandatory=slice(23, data_len))]
+        )
+
+    # Initialize blocks.
+    blocks = _Blocks()
+
+    # Loop through legs.
+    for leg_index in range(leg_count):
+        leg_blocks = _LegBlocks()
+        blocks.repeated.append(leg_blocks)
+
+        # Mandatory Repeated block
+        mand_rept_start = blocks.prev_leg_stop(leg_index)
+        mand_rept_stop = mand_rept_start + _MAND_REPT_SIZE
+        if mand_rept_stop > data_len:
+            return False, leg_count, blocks
+        leg_blocks.mandatory = slice(
+            mand_rept_start, mand_rept_stop
+        )
+        cond_airline_size = _parse_hex(
+            bcbp_str[mand_rept_stop - 2:mand_rept_stop])
+        if cond_airline_size is None:
+            return False, leg_count, blocks
+        if cond_airline_size == 0:
+            # No conditional or airline items.
+            continue
+        leg_stop = mand_rept_stop + cond_airline_size
+        if leg_stop > data_len:
+            return False, leg_count, blocks
+
+        # Conditional Unique block (first leg only)
+        if leg_index == 0:
+            if cond_airline_size < 4:
+                # Conditional Unique not big enough to contain size
+                # field
+                blocks.unique.conditional = slice(
+                    mand_rept_stop, mand_rept_start + cond_airline_size
+                )
+                continue
+            cond_uniq_size = _parse_hex(
+                bcbp_str[mand_rept_stop + 2:mand_rept_stop + 4]
+            )
+            if cond_uniq_size is None:
+                return False, leg_count, blocks
+            cond_rept_start = mand_rept_stop + 4 + cond_uniq_size
+            if cond_rept_start > data_len:
+                return False, leg_count, blocks
+            blocks.unique.conditional = slice(
+                mand_rept_stop, cond_rept_start
+            )
+        else:
+            cond_rept_start = mand_rept_stop
+
+        # Conditional Repeated block
+        if cond_rept_start == leg_stop:
+            # No more data.
+            continue
+        if cond_rept_start + 2 > leg_stop:
+            # Conditional not big enough to contain Conditional
+            # Repeated size field.
+            leg_blocks.conditional = slice(
+                cond_rept_start, leg_stop
+            )
+        cond_rept_size = _parse_hex(
+            bcbp_str[cond_rept_start:cond_rept_start + 2]
+        )
+        if cond_rept_size is None:
+            return False, leg_count, blocks
+        cond_rept_stop = cond_rept_start + 2 + cond_rept_size
+        if cond_rept_stop > data_len:
+            return False, leg_count, blocks
+        leg_blocks.conditional = slice(
+            cond_rept_start, cond_rept_stop
+        )
+
+        # Airline Repeated block
+        if cond_rept_stop == leg_stop:
+            # No more data.
+            continue
+        leg_blocks.airline = slice(
+            cond_rept_stop, leg_stop
+        )
+
+    # Security block
+    security_start = blocks.prev_leg_stop(leg_count)
+    if security_start < data_len:
+        blocks.unique.security = slice(
+            security_start, data_len
+        )
+    return True, leg_count, blocks
+
+@lru_cache(maxsize=4096)
+def _clean_flight_number(raw: str) -> str:
+    """Removes padding and leading zeroes from a flight number."""
+    return raw.strip().lstrip("0") or "0"
+
+def _latest_flight_date() -> date:
+    """
+    Gets the latest date a flight without a pass date is assumed to be.
+
+    Flights are assumed to be up to 3 days in the future.
+    """
+    return (datetime.now() + timedelta(days=3)).date()
+
+@lru_cache(maxsize=16)
+def _jan_1_ordinal(year: int) -> int:
+    """Gets the proleptic Gregorian ordinal of January 1 of a year."""
+    return date(year, 1, 1).toordinal()
 
 def _ordinal_date(year: int, day_of_year: int):
     """Creates a date from a year and day of year."""
@@ -399,10 +477,13 @@ def _ordinal_date(year: int, day_of_year: int):
         return None
     if day_of_year == 366 and not calendar.isleap(year):
         return None
-    return date(year, 1, 1) + timedelta(days=day_of_year-1)
+    return date.fromordinal(_jan_1_ordinal(year) + day_of_year - 1)
 
 def _parse_hex(hex_str) -> int | None:
     """Parses a hexadecimal string."""
+    value = _HEX_PAIRS.get(hex_str)
+    if value is not None:
+        return value
     try:
         return int(hex_str, 16)
     except ValueError:
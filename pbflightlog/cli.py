@@ -0,0 +1,225 @@
+"""Command-line argument parsing for the flight log tools."""
+
+# Standard imports
+import argparse
+import sys
+from pathlib import Path
+
+_HELP_FLAGS = ("-h", "--help")
+
+def main():
+    """CLI entry point."""
+    parser = argparse.ArgumentParser(
+        description="Tools for interacting with a local flight log."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # Only build the subparser for the requested command. Fall back to
+    # building all subparsers for help or unknown commands, so that
+    # argparse can list every command.
+    command = _sniff_command(sys.argv[1:])
+    if command in _BUILDERS:
+        _BUILDERS[command](subparsers)
+    else:
+        for build in _BUILDERS.values():
+            build(subparsers)
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    # Project imports are deferred until a command is dispatched, so
+    # that help and argument errors don't need to load them.
+    import pbflightlog.tools as flt
+
+    handler = _HANDLERS[(args.command, args.entity)]
+    handler(flt, args)
+
+def _add_flight(flt, args) -> None:
+    """Runs the add flight command with the selected flight source."""
+    if args.bcbp is not None:
+        flt.add_flight_bcbp(args.bcbp, geojson=args.geojson)
+    elif args.fa_flight_id is not None:
+        flt.add_flight_fa_flight_id(args.fa_flight_id, geojson=args.geojson)
+    elif args.flight_number is not None:
+        flt.add_flight_number(*args.flight_number, geojson=args.geojson)
+    elif args.pkpasses:
+        flt.add_flight_pkpasses(geojson=args.geojson)
+
+def _build_add(subparsers) -> None:
+    """Builds the add command parser."""
+    add_parser = subparsers.add_parser(
+        "add",
+        help="Add items to flight log",
+    )
+    add_subparsers = add_parser.add_subparsers(dest="entity", required=True)
+
+    # add flight
+    add_flight_parser = add_subparsers.add_parser(
+        "flight",
+    )
+    add_flight_parser.add_argument("--geojson",
+        help="Save flight to GeoJSON file instead of database",
+        metavar="GEOJSON_PATH",
+        type=Path,
+    )
+    add_flight_source_group = add_flight_parser.add_mutually_exclusive_group(
+        required=True, # Set to false if we create GUI add flight option
+    )
+    add_flight_source_group.add_argument("--bcbp",
+        help="Add flight(s) from a BCBP-coded text string",
+        metavar="BCBP_TEXT",
+        type=str,
+    )
+    add_flight_source_group.add_argument("--fa-flight-id",
+        help="Add a flight from an FlightAware fa_flight_id",
+        type=str,
+    )
+    add_flight_source_group.add_argument("--number",
+        dest="flight_number",
+        help=(
+            "Add a flight from an airline code (ICAO preferred) and "
+            "flight number"
+        ),
+        nargs=2,
+        metavar=("AIRLINE_CODE", "FLIGHT_NUMBER"),
+        type=str,
+    )
+    add_flight_source_group.add_argument("--pkpasses",
+        action="store_true",
+        help="Add flights from .pkpass files in the import folder"
+    )
+
+def _build_index(subparsers) -> None:
+    """Builds the index command parser."""
+    index_parser = subparsers.add_parser(
+        "index",
+        help="Display indexes",
+    )
+
+    index_parser_subparsers = index_parser.add_subparsers(
+        dest="entity",
+        required=True,
+    )
+
+    # index airports
+    index_airports_parser = index_parser_subparsers.add_parser(
+        "airports",
+        help="Display an airport index",
+    )
+    index_airports_parser.add_argument("-o", "--output",
+        help="Write index to a file (CSV format)",
+        metavar="FILE",
+        type=Path,
+    )
+    index_airports_parser.add_argument("-y", "--year",
+        help="Filter by departures in a specific year",
+        type=int,
+    )
+
+    # index_tails
+    index_parser_subparsers.add_parser(
+        "tails",
+        help="Display a tail number index",
+    )
+
+def _build_show(subparsers) -> None:
+    """Builds the show command parser."""
+    show_parser = subparsers.add_parser(
+        "show",
+        help="Show details for specific entities",
+    )
+
+    show_parser_subparsers = show_parser.add_subparsers(
+        dest="entity",
+        required=True,
+    )
+
+    # show airport
+    show_airport_parser = show_parser_subparsers.add_parser(
+        "airport",
+        help="Show details about an airport",
+    )
+    show_airport_parser.add_argument("id",
+        help="Airport identifier (fid, IATA, ICAO, or FAA LID)",
+        type=str,
+    )
+
+    # show tail
+    show_tail_parser = show_parser_subparsers.add_parser(
+        "tail",
+        help="Show details about a tail number",
+    )
+    show_tail_parser.add_argument("tail_number",
+        help="Tail number",
+        type=str,
+    )
+
+def _build_refresh(subparsers) -> None:
+    """Builds the refresh command parser."""
+    refresh_parser = subparsers.add_parser(
+        "refresh",
+        help="Refresh flight log data",
+    )
+    refresh_parser_subparsers = refresh_parser.add_subparsers(
+        dest="entity",
+        required=True,
+    )
+
+    # refresh routes
+    refresh_parser_subparsers.add_parser(
+        "routes",
+        help="Manually refresh routes layer",
+    )
+
+def _build_report(subparsers) -> None:
+    """Builds the report command parser."""
+    report_parser = subparsers.add_parser(
+        "report",
+        help="Generate reports",
+    )
+    report_parser_subparsers = report_parser.add_subparsers(
+        dest="entity",
+        required=True,
+    )
+
+    # report milestones
+    report_parser_subparsers.add_parser(
+        "milestones",
+        help="Generate a report of flying milestones"
+    )
+
+_BUILDERS = {
+    'add': _build_add,
+    'index': _build_index,
+    'show': _build_show,
+    'refresh': _build_refresh,
+    'report': _build_report,
+}
+
+# Command handlers, keyed by (command, entity). Each handler is called
+# with the tools module and the parsed arguments.
+_HANDLERS = {
+    ('add', 'flight'): _add_flight,
+    ('index', 'airports'): lambda flt, args: flt.index_airports(
+        args.year, args.output
+    ),
+    ('index', 'tails'): lambda flt, args: flt.index_tails(),
+    ('show', 'airport'): lambda flt, args: flt.show_airport(args.id),
+    ('show', 'tail'): lambda flt, args: flt.show_tail(args.tail_number),
+    ('refresh', 'routes'): lambda flt, args: flt.refresh_routes(),
+    ('report', 'milestones'): lambda flt, args: flt.report_milestones(),
+}
+
+def _sniff_command(argv: list[str]) -> str | None:
+    """
+    Finds the command in a list of arguments.
+
+    Returns None if no command was given, or if a help flag appears
+    before the command.
+    """
+    for arg in argv:
+        if arg in _HELP_FLAGS:
+            return None
+        if not arg.startswith("-"):
+            return arg
+    return None
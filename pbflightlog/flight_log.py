@@ -7,6 +7,7 @@ import re
 import sqlite3
 import sys
 from datetime import datetime, date, timedelta
+from functools import cache, lru_cache
 from math import ceil
 from pathlib import Path
 from typing import Self
@@ -14,9 +15,11 @@ from zoneinfo import ZoneInfo
 
 # Third-party imports
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from dateutil.parser import isoparse
+import pyogrio
 from pyproj import Geod
+import shapely
 from shapely.geometry import Point, LineString, MultiLineString
 from tabulate import tabulate
 
@@ -28,6 +31,7 @@ METERS_PER_HUNDRED_FEET = 30.48
 METERS_BETWEEN_GC_POINTS = 100000
 
 CRS = "EPSG:4326" # WGS-84
+GEOD = Geod(ellps="WGS84")
 
 flight_log = os.getenv("PBFLIGHTLOG_GEOPACKAGE_PATH")
 if flight_log is None:
@@ -40,16 +44,14 @@ class Record():
     LAYER = None
     FIND_BY_CODES = []
     DTYPES = {}
+    # Lookup layers aren't modified by these tools, so they are read
+    # once and cached for the rest of the run.
+    CACHE_LAYER = False
 
     @classmethod
     def all(cls) -> gpd.GeoDataFrame:
         """Returns a GeoDataFrame of all records."""
-        records = gpd.read_file(
-            flight_log,
-            layer=cls.LAYER,
-            engine="pyogrio",
-            fid_as_index=True,
-        ).astype(cls.DTYPES)
+        records = cls._read_layer().astype(cls.DTYPES)
         return records
 
     @classmethod
@@ -65,48 +67,60 @@ class Record():
             return None
         if len(cls.FIND_BY_CODES) == 0:
             return None
-        records = gpd.read_file(
-            flight_log,
-            layer = cls.LAYER,
-            engine="pyogrio",
-            fid_as_index=True,
-        )
+        records = cls._read_layer()
 
         # Check for fid on numeric codes. Note that this will allow
         # defunct records since fids are unique.
         if check_fid and re.search(r'^[0-9]+$', code):
             if int(code) in records.index:
-                record_dict = records.loc[int(code)].to_dict()
-                record_dict['fid'] = int(code)
-                record = cls()
-                for key, value in record_dict.items():
-                    setattr(record, key, value)
-                return record
-
-        # Filter out defunct records. This is helpful in situations
-        # where current records use the same codes as an old record
-        # (for example, the current PSA airlines and the defunct Comair
-        # both use the IATA code 'OH'.)
-        if 'is_defunct' in records.columns:
-            records = records[~records['is_defunct']]
+                return cls._from_row(int(code), records.loc[int(code)])
+
+        fid = cls.find_fid_by_code(code)
+        if fid is None:
+            return None
+        return cls._from_row(fid, records.loc[fid])
+
+    @classmethod
+    def find_fid_by_code(cls, code: str | None) -> int | None:
+        """
+        Finds a record's fid by searching through code fields.
+
+        Unlike find_by_code, this doesn't build the record, and returns
+        None without a warning if no code is provided.
+        """
+        if not code or not getattr(cls, 'FIND_BY_CODES', None):
+            return None
         for code_type in cls.FIND_BY_CODES:
             # Search for matching codes.
-            matching_code = records[records[code_type] == code]
-            if len(matching_code) == 1:
-                record_dict = matching_code.iloc[0].to_dict()
-                record_dict['fid'] = int(matching_code.index[0])
-                record = cls()
-                for key, value in record_dict.items():
-                    setattr(record, key, value)
-                return record
+            fid = _code_index(cls.LAYER, code_type).get(code)
+            if fid is not None:
+                return fid
         print(f"⚠️ Could not find {cls.__name__} matching \"{code}\".")
         return None
 
+    @classmethod
+    def _from_row(cls, fid: int, row: pd.Series) -> Self:
+        """Creates a record from a layer row."""
+        record_dict = row.to_dict()
+        record_dict['fid'] = fid
+        record = cls()
+        for key, value in record_dict.items():
+            setattr(record, key, value)
+        return record
+
+    @classmethod
+    def _read_layer(cls) -> gpd.GeoDataFrame:
+        """Reads this record type's layer from the flight log."""
+        if cls.CACHE_LAYER:
+            return _read_cached_layer(cls.LAYER)
+        return _read_layer(cls.LAYER)
+
 class AircraftType(Record):
     """Represents an aircraft type record."""
     LAYER = "aircraft_types"
     FIND_BY_CODES = ['icao_code']
     DTYPES = {}
+    CACHE_LAYER = True
 
     def __init__(self):
         # Fields used in flight log database:
@@ -123,6 +137,7 @@ class Airline(Record):
     LAYER = "airlines"
     FIND_BY_CODES = ['icao_code', 'iata_code']
     DTYPES = {}
+    CACHE_LAYER = True
 
     def __init__(self):
         # Fields used in flight log database:
@@ -139,6 +154,7 @@ class Airport(Record):
     LAYER = "airports"
     FIND_BY_CODES = ['icao_code', 'iata_code', 'faa_lid']
     DTYPES = {}
+    CACHE_LAYER = True
 
     def __init__(self):
         # Fields used in flight log database:
@@ -214,7 +230,14 @@ class Flight(Record):
         if self.fa_flight_id is None:
             print("⚠️ Cannot get track: fa_flight_id is not set.")
             return
-        fa_json = aero.get_flights_ident_track(self.fa_flight_id)
+        fa_json = aero.get_flights_ident_track(
+            self.fa_flight_id,
+            complete=True,
+        )
+        self.set_aeroapi_track_geometry(fa_json)
+
+    def set_aeroapi_track_geometry(self, fa_json: dict | None) -> None:
+        """Sets geometry and distance from an AeroAPI track response."""
         if fa_json is None:
             print(f"⚠️ No track found for {self.fa_flight_id}.")
             return
@@ -222,11 +245,13 @@ class Flight(Record):
         if len(positions) == 0:
             print(f"⚠️ No positions found for {self.fa_flight_id}.")
             return
-        track_ls = LineString([Point(
+        coords = np.array([(
             p.get('longitude'),
             p.get('latitude'),
-            p.get('altitude') * METERS_PER_HUNDRED_FEET,
-        ) for p in positions])
+            p.get('altitude'),
+        ) for p in positions], dtype=float)
+        coords[:, 2] *= METERS_PER_HUNDRED_FEET
+        track_ls = LineString(coords)
         self.geometry = split_at_antimeridian(track_ls)
         self.geom_source = "FlightAware"
         try:
@@ -245,7 +270,11 @@ class Flight(Record):
 
     def gdf(self) -> gpd.GeoDataFrame:
         """Returns a GeoDataFrame record for the flight."""
-        record = {
+        return gpd.GeoDataFrame([self._record()], geometry='geometry', crs=CRS)
+
+    def _record(self) -> dict:
+        """Returns the flight's layer fields as a dict."""
+        return {
             'geometry': self.geometry,
             'departure_utc': _format_time(self.departure_utc),
             'arrival_utc': _format_time(self.arrival_utc),
@@ -268,34 +297,41 @@ class Flight(Record):
             'distance_mi': self.distance_mi,
             'comments': None,
         }
-        return gpd.GeoDataFrame([record], geometry='geometry', crs=CRS)
 
     def save(self, geojson: Path | None = None) -> None:
         """Appends a flight to the geopackage file."""
-        record_gdf = self.gdf()
-
-        # Check for matching tail numbers.
-        if self.tail_number is not None:
-            tails_gdf = Flight.all()
-            tails_gdf = tails_gdf[tails_gdf['tail_number'] == self.tail_number]
-            if len(tails_gdf) > 0:
-                print(
-                    f"You've now had {len(tails_gdf) + 1} flights on tail "
-                    + f"number '{self.tail_number}'!"
-                )
-
         if geojson is not None:
             # Save to GeoJSON instead of database.
-            record_gdf.to_file(geojson, driver='GeoJSON')
+            self._announce_tail_number()
+            self.gdf().to_file(geojson, driver='GeoJSON')
             print(f"Wrote flight to {geojson}.")
             sys.exit(0)
-        existing = gpd.read_file(
-            flight_log,
-            layer=Flight.LAYER,
-            engine="pyogrio",
-            rows=0,
+        Flight.save_all([self])
+
+    @classmethod
+    def save_all(cls, flights: list[Self]) -> None:
+        """Appends flights to the geopackage file in a single write."""
+        if len(flights) == 0:
+            return
+        # Flights earlier in the batch aren't in the layer yet, so add
+        # them to each flight's tail number count.
+        batch_tail_counts: dict[str, int] = {}
+        for flight in flights:
+            flight._announce_tail_number(
+                batch_tail_counts.get(flight.tail_number, 0)
+            )
+            batch_tail_counts[flight.tail_number] = (
+                batch_tail_counts.get(flight.tail_number, 0) + 1
+            )
+        # Build all records as one GeoDataFrame, rather than building
+        # and concatenating a GeoDataFrame per flight.
+        record_gdf = gpd.GeoDataFrame(
+            [flight._record() for flight in flights],
+            geometry='geometry',
+            crs=CRS,
         )
-        existing_cols = list(existing.columns)
+
+        existing_cols = _layer_columns(cls.LAYER)
         incoming_cols = list(record_gdf.columns)
 
         # Check that geometry column name matches.
@@ -323,16 +359,43 @@ class Flight(Record):
                     "its value to null."
                 )
 
-        # Reorder columns to match existing schema.
+        # Reorder columns to match existing schema. Writing all flights
+        # in one call lets them be inserted in a single transaction.
         gdf = record_gdf[existing_cols]
         gdf.to_file(
             flight_log,
             driver="GPKG",
             engine="pyogrio",
-            layer=Flight.LAYER,
+            layer=cls.LAYER,
             mode="a",
         )
-        print(f"Appended flight to {flight_log}.")
+        if len(flights) == 1:
+            print(f"Appended flight to {flight_log}.")
+        else:
+            print(f"Appended {len(flights)} flights to {flight_log}.")
+
+    def _announce_tail_number(self, unsaved_count: int = 0) -> None:
+        """
+        Prints how many flights have been on this tail number.
+
+        unsaved_count is the number of other flights on this tail
+        number that are being saved along with this one, but haven't
+        been written yet.
+        """
+        if self.tail_number is None:
+            return
+        con = sqlite3.connect(flight_log)
+        (tail_count,) = con.execute(
+            f"SELECT COUNT(*) FROM {Flight.LAYER} WHERE tail_number = ?",
+            (self.tail_number,),
+        ).fetchone()
+        con.close()
+        tail_count += unsaved_count
+        if tail_count > 0:
+            print(
+                f"You've now had {tail_count + 1} flights on tail "
+                + f"number '{self.tail_number}'!"
+            )
 
 
     def _arr_utc(self) -> datetime | None:
@@ -372,27 +435,24 @@ class Flight(Record):
         flight.flight_number = fa_json.get('flight_number')
 
         origin = fa_json.get('origin', {})
-        flight.origin_airport_fid = getattr(
-            Airport.find_by_code(origin.get('code')), 'fid', None
+        flight.origin_airport_fid = Airport.find_fid_by_code(
+            origin.get('code')
         )
         flight.origin_code = origin.get('code_iata') or origin.get('code')
         flight.origin_tz = origin.get('timezone')
 
         destination = fa_json.get('destination', {})
-        flight.destination_airport_fid = getattr(
-            Airport.find_by_code(destination.get('code')), 'fid', None
+        flight.destination_airport_fid = Airport.find_fid_by_code(
+            destination.get('code')
         )
         flight.destination_code = destination.get('code_iata') \
             or destination.get('code')
         flight.destination_tz = destination.get('timezone')
 
-        flight.aircraft_type_fid = getattr(
-            AircraftType.find_by_code(fa_json.get('aircraft_type')),
-            'fid', None
-        )
-        flight.operator_fid = getattr(
-            Airline.find_by_code(fa_json.get('operator')), 'fid', None
+        flight.aircraft_type_fid = AircraftType.find_fid_by_code(
+            fa_json.get('aircraft_type')
         )
+        flight.operator_fid = Airline.find_fid_by_code(fa_json.get('operator'))
         flight.tail_number = fa_json.get('registration')
         flight.fa_flight_id = fa_json.get('fa_flight_id')
         return flight
@@ -402,7 +462,7 @@ class Flight(Record):
         """Parses a datetime string."""
         if dt_str is None:
             return None
-        return isoparse(dt_str)
+        return datetime.fromisoformat(dt_str)
 
 class Route(Record):
     """Represents a route record"""
@@ -493,6 +553,17 @@ def airport_visits(flights_gdf: gpd.GeoDataFrame) -> pd.Series:
         .stack().value_counts()
     return counts
 
+def clear_layer_cache() -> None:
+    """
+    Clears cached lookup layers, so they are read again when used.
+
+    Writing flights or routes doesn't change the cached layers. Call
+    this after writing to an airports, airlines, or aircraft types
+    layer in the same run.
+    """
+    _read_cached_layer.cache_clear()
+    _code_index.cache_clear()
+
 def count_origin_visits(flights_gdf: gpd.GeoDataFrame) -> pd.Series:
     """Determines whether to count origins as a visit."""
     flights_gdf = flights_gdf[[
@@ -613,29 +684,25 @@ def great_circle_route(point1, point2) -> pd.Series:
     Returns a Pandas series with distance in integer miles and a
     MultiLineString geometry.
     """
-    if point1 == point2:
+    if point1.x == point2.x and point1.y == point2.y:
         # Returned to same airport. Return zero great circle distance
         # and no geometry.
         return pd.Series([0, None])
-    geod = Geod(ellps="WGS84")
-    _, _, dist_m = geod.inv(point1.x, point1.y, point2.x, point2.y)
+    _, _, dist_m = GEOD.inv(point1.x, point1.y, point2.x, point2.y)
     dist_mi = int(round(dist_m / METERS_PER_MILE))
-
-    # Create a great circle LineString.
-    num_points = ceil(dist_m / METERS_BETWEEN_GC_POINTS) + 1
-    midpoints = geod.npts(
-        point1.x, point1.y,
-        point2.x, point2.y,
-        num_points - 2,
-    )
-    geom = split_at_antimeridian(
-        LineString([point1, *midpoints, point2])
+    geom = _great_circle_geometry(
+        point1.x, point1.y, point2.x, point2.y, dist_m
     )
-
     return pd.Series([dist_mi, geom])
 
-def refresh_routes():
-    """Updates the routes layer based on logged flights."""
+def refresh_routes(rebuild: bool = True) -> None:
+    """
+    Updates the routes layer based on logged flights.
+
+    If rebuild is False and the flights have the same origin and
+    destination pairs as the existing routes, only the route flight
+    counts are updated. Otherwise, all routes are regenerated.
+    """
     con = sqlite3.connect(flight_log)
     flights_sql = """
         SELECT origin_airport_fid, destination_airport_fid,
@@ -645,20 +712,37 @@ def refresh_routes():
         ORDER BY origin_airport_fid, destination_airport_fid
     """
     flights_df = pd.read_sql(flights_sql, con)
+    if not rebuild and _update_route_counts(con, flights_df):
+        con.close()
+        print(f"Updated route flight counts in {flight_log}.")
+        return
     con.close()
 
-    airports = gpd.read_file(
-        flight_log,
-        layer='airports',
-        engine='pyogrio',
-        fid_as_index=True,
-    )
+    # Only airport locations are needed.
+    airports = _read_layer(Airport.LAYER, columns=[])
 
-    flights_df[['distance_mi', 'geometry']] = flights_df.apply(lambda f:
-        _great_circle_airport_lookup(f, airports),
-        axis = 1,
+    # Look up endpoint coordinates for all routes at once, as arrays of
+    # (lon, lat) rows. Routes with an unknown airport get NaN
+    # coordinates, and so no distance or geometry.
+    coords = pd.DataFrame(
+        {'lon': airports.geometry.x, 'lat': airports.geometry.y}
+    )
+    orig = coords.reindex(flights_df['origin_airport_fid']).to_numpy()
+    dest = coords.reindex(flights_df['destination_airport_fid']).to_numpy()
+    _, _, dist_m = GEOD.inv(orig[:, 0], orig[:, 1], dest[:, 0], dest[:, 1])
+    flights_df['distance_mi'] = (
+        pd.Series(dist_m / METERS_PER_MILE, index=flights_df.index)
+        .round()
+        .astype("Int64")
     )
-    flights_df['distance_mi'] = flights_df['distance_mi'].astype("Int64")
+
+    # Build geometries only for routes between two different airports.
+    geometries = [None] * len(flights_df)
+    for i in np.flatnonzero(dist_m > 0):
+        geometries[i] = _great_circle_geometry(
+            *orig[i], *dest[i], dist_m[i]
+        )
+    flights_df['geometry'] = geometries
 
     routes_gdf = gpd.GeoDataFrame(flights_df, geometry='geometry', crs=CRS)
 
@@ -668,6 +752,9 @@ def refresh_routes():
         engine='pyogrio',
         layer='routes',
         mode='w',
+        # Routes are regenerated on every refresh, so skip building a
+        # spatial index for them.
+        SPATIAL_INDEX='NO',
     )
     print(
         f"Updated all routes in {flight_log}."
@@ -675,40 +762,58 @@ def refresh_routes():
 
 def split_at_antimeridian(track_ls: LineString) -> MultiLineString:
     """Split a LineString at the antimeridian."""
+    # A track can't cross the antimeridian unless it spans more than 180
+    # degrees of longitude, so most tracks can skip the search.
+    min_lon, _, max_lon, _ = track_ls.bounds
+    if not max_lon - min_lon > 180:
+        return MultiLineString([track_ls])
+
     # Find all points where the track crosses the antimeridian.
-    crossings = [
-        i + 1 for i, (p1, p2)
-        in enumerate(zip(track_ls.coords[:-1], track_ls.coords[1:]))
-        if abs(p1[0] - p2[0]) > 180
-    ]
+    lons = shapely.get_coordinates(track_ls)[:, 0]
+    crossings = (np.flatnonzero(np.abs(np.diff(lons)) > 180) + 1).tolist()
     if len(crossings) == 0:
         return MultiLineString([track_ls])
 
-    # Split the track at the indices.
-    tracks = []
+    # Split the track at the indices. Each track gets the crossing point
+    # added to its end, and the next track gets it added to its start.
+    coords = list(track_ls.coords)
     starts = [0, *crossings]
-    ends = [*crossings, len(track_ls.coords)-1]
-    tracks = [
-        track_ls.coords[start:end] for start, end in zip(starts, ends)
-    ]
-    for i, track in enumerate(tracks):
-        if i > 0:
-            p1 = track[0]
-            p2 = tracks[i-1][-1]
-            p_cross = _crossing_point(p1, p2)
+    ends = [*crossings, len(coords)]
+    tracks = []
+    for start, end in zip(starts, ends):
+        track = coords[start:end]
+        if start > 0:
+            p_cross = _crossing_point(coords[start], coords[start - 1])
             if p_cross is not None:
-                track.insert(0, p_cross)
-        if i < len(crossings):
-            p1 = track[-1]
-            p2 = tracks[i+1][0]
-            p_cross = _crossing_point(p1, p2)
+                track = [p_cross, *track]
+        if end < len(coords):
+            p_cross = _crossing_point(coords[end - 1], coords[end])
             if p_cross is not None:
                 track.append(p_cross)
+        tracks.append(track)
 
     # Filter out tracks with only one point.
     tracks = [track for track in tracks if len(track) > 1]
     return MultiLineString(tracks)
 
+@cache
+def _code_index(layer: str, code_type: str) -> dict[str, int]:
+    """
+    Maps codes of one type to fids for a cached lookup layer.
+
+    Defunct records are left out. This is helpful in situations where
+    current records use the same codes as an old record (for example,
+    the current PSA airlines and the defunct Comair both use the IATA
+    code 'OH'.) Codes shared by more than one current record are also
+    left out, since they can't identify a single record.
+    """
+    records = _read_cached_layer(layer)
+    if 'is_defunct' in records.columns:
+        records = records[~records['is_defunct']]
+    codes = records[code_type].dropna()
+    codes = codes[~codes.duplicated(keep=False)]
+    return {code: int(fid) for fid, code in codes.items()}
+
 def _crossing_point(p1, p2):
     """Return the point where a track crosses the antemeridian.
     Returns None if p1 is already on the antemeridian.
@@ -743,12 +848,118 @@ def _format_time(time_val):
         return None
     return time_val.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def _great_circle_airport_lookup(row, airports):
-    """Runs great_circle_route with a GeoDataFrame row."""
+@lru_cache(maxsize=4096)
+def _great_circle_geometry(
+    lon1: float,
+    lat1: float,
+    lon2: float,
+    lat2: float,
+    dist_m: float,
+) -> MultiLineString:
+    """
+    Creates a great circle MultiLineString between distinct points.
+
+    Results are cached by coordinates, so routes that are flown often
+    are only generated once per process.
+    """
+    num_points = ceil(dist_m / METERS_BETWEEN_GC_POINTS) + 1
+    line = GEOD.inv_intermediate(
+        lon1, lat1, lon2, lat2,
+        npts=num_points,
+        initial_idx=0,
+        terminus_idx=0,
+        return_back_azimuth=False,
+    )
+    coords = np.column_stack([line.lons, line.lats])
+    # Keep the endpoints exactly at the airports.
+    coords[[0, -1]] = [(lon1, lat1), (lon2, lat2)]
+    return split_at_antimeridian(LineString(coords))
+
+@cache
+def _layer_columns(layer: str) -> list[str]:
+    """
+    Gets the column names of a layer, in GeoDataFrame order.
+
+    Reads only the layer metadata, and caches the result since layer
+    schemas don't change at runtime.
+    """
+    info = pyogrio.read_info(flight_log, layer=layer)
+    return [*info['fields'], 'geometry']
+
+def _update_route_counts(
+    con: sqlite3.Connection,
+    flights_df: pd.DataFrame,
+) -> bool:
+    """
+    Updates flight counts on existing routes.
+
+    Returns False without making changes if the flights have any origin
+    and destination pair that isn't in the routes layer, or the routes
+    layer has a pair that no longer has flights.
+    """
+    routes_sql = f"""
+        SELECT fid, origin_airport_fid, destination_airport_fid,
+            flight_count
+        FROM {Route.LAYER}
+    """
     try:
-        return great_circle_route(
-            airports.loc[row.origin_airport_fid, 'geometry'],
-            airports.loc[row.destination_airport_fid, 'geometry'],
+        routes_df = pd.read_sql(routes_sql, con)
+    except pd.errors.DatabaseError:
+        return False
+    merged = flights_df.merge(
+        routes_df,
+        on=['origin_airport_fid', 'destination_airport_fid'],
+        how='outer',
+        suffixes=('', '_route'),
+        indicator=True,
+    )
+    if (merged['_merge'] != 'both').any():
+        return False
+
+    changed = merged[merged['flight_count'] != merged['flight_count_route']]
+    if len(changed) > 0:
+        con.executemany(
+            f"UPDATE {Route.LAYER} SET flight_count = ? WHERE fid = ?",
+            [
+                (int(count), int(fid)) for count, fid
+                in zip(changed['flight_count'], changed['fid'])
+            ],
+        )
+        con.execute(
+            """
+            UPDATE gpkg_contents
+            SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
+            WHERE table_name = ?
+            """,
+            (Route.LAYER,),
         )
-    except KeyError:
-        return pd.Series([None, None])
+        con.commit()
+    return True
+
+def _read_layer(
+    layer: str,
+    columns: list[str] | None = None,
+) -> gpd.GeoDataFrame:
+    """
+    Reads a layer from the flight log.
+
+    If columns are provided, only those columns (and the geometry) are
+    read.
+    """
+    return gpd.read_file(
+        flight_log,
+        layer=layer,
+        engine="pyogrio",
+        fid_as_index=True,
+        columns=columns,
+    )
+
+@cache
+def _read_cached_layer(layer: str) -> gpd.GeoDataFrame:
+    """
+    Reads a layer from the flight log, caching it for the rest of the
+    run.
+
+    The cached GeoDataFrame is shared, so callers must not modify it.
+    """
+    return _read_layer(layer)
@@ -1,9 +1,9 @@
 """Functions for CLI commands."""
 
 # Standard imports
-import argparse
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -16,188 +16,11 @@ import pbflightlog.flight_log as fl
 import pbflightlog.report as report
 from pbflightlog.boarding_pass import BoardingPass, PKPass
 
-def main():
-    """CLI entry point."""
-    parser = argparse.ArgumentParser(
-        description="Tools for interacting with a local flight log."
-    )
-    subparsers = parser.add_subparsers(dest="command", required=True)
-
-    # add
-    add_parser = subparsers.add_parser(
-        "add",
-        help="Add items to flight log",
-    )
-    add_subparsers = add_parser.add_subparsers(dest="entity", required=True)
-
-    # add flight
-    add_flight_parser = add_subparsers.add_parser(
-        "flight",
-    )
-    add_flight_parser.add_argument("--geojson",
-        help="Save flight to GeoJSON file instead of database",
-        metavar="GEOJSON_PATH",
-        type=Path,
-    )
-    add_flight_source_group = add_flight_parser.add_mutually_exclusive_group(
-        required=True, # Set to false if we create GUI add flight option
-    )
-    add_flight_source_group.add_argument("--bcbp",
-        help="Add flight(s) from a BCBP-coded text string",
-        metavar="BCBP_TEXT",
-        type=str,
-    )
-    add_flight_source_group.add_argument("--fa-flight-id",
-        help="Add a flight from an FlightAware fa_flight_id",
-        type=str,
-    )
-    add_flight_source_group.add_argument("--number",
-        dest="flight_number",
-        help=(
-            "Add a flight from an airline code (ICAO preferred) and "
-            "flight number"
-        ),
-        nargs=2,
-        metavar=("AIRLINE_CODE", "FLIGHT_NUMBER"),
-        type=str,
-    )
-    add_flight_source_group.add_argument("--pkpasses",
-        action="store_true",
-        help="Add flights from .pkpass files in the import folder"
-    )
-
-    # index
-    index_parser = subparsers.add_parser(
-        "index",
-        help="Display indexes",
-    )
-
-    index_parser_subparsers = index_parser.add_subparsers(
-        dest="entity",
-        required=True,
-    )
-
-    # index airports
-    index_airports_parser = index_parser_subparsers.add_parser(
-        "airports",
-        help="Display an airport index",
-    )
-    index_airports_parser.add_argument("-o", "--output",
-        help="Write index to a file (CSV format)",
-        metavar="FILE",
-        type=Path,
-    )
-    index_airports_parser.add_argument("-y", "--year",
-        help="Filter by departures in a specific year",
-        type=int,
-    )
-
-    # index_tails
-    index_tails_parser = index_parser_subparsers.add_parser(
-        "tails",
-        help="Display a tail number index",
-    )
-
-    # show
-    show_parser = subparsers.add_parser(
-        "show",
-        help="Show details for specific entities",
-    )
-
-    show_parser_subparsers = show_parser.add_subparsers(
-        dest="entity",
-        required=True,
-    )
-
-    # show airport
-    show_airport_parser = show_parser_subparsers.add_parser(
-        "airport",
-        help="Show details about an airport",
-    )
-    show_airport_parser.add_argument("id",
-        help="Airport identifier (fid, IATA, ICAO, or FAA LID)",
-        type=str,
-    )
-
-    # show tail
-    show_tail_parser = show_parser_subparsers.add_parser(
-        "tail",
-        help="Show details about a tail number",
-    )
-    show_tail_parser.add_argument("tail_number",
-        help="Tail number",
-        type=str,           
-    )
-
-    # refresh
-    refresh_parser = subparsers.add_parser(
-        "refresh",
-        help="Refresh flight log data",
-    )
-    refresh_parser_subparsers = refresh_parser.add_subparsers(
-        dest="entity",
-        required=True,
-    )
-
-    # refresh routes
-    refresh_parser_subparsers.add_parser(
-        "routes",
-        help="Manually refresh routes layer",
-    )
-
-    # report
-    report_parser = subparsers.add_parser(
-        "report",
-        help="Generate reports",
-    )
-    report_parser_subparsers = report_parser.add_subparsers(
-        dest="entity",
-        required=True,
-    )
-
-    # report milestones
-    report_parser_subparsers.add_parser(
-        "milestones",
-        help="Generate a report of flying milestones"
-    )
-
-    # Parse arguments
-    args = parser.parse_args()
-    if args.command == "add":
-        if args.entity == "flight":
-            if args.bcbp is not None:
-                add_flight_bcbp(args.bcbp, geojson=args.geojson)
-            elif args.fa_flight_id is not None:
-                add_flight_fa_flight_id(
-                    args.fa_flight_id,
-                    geojson=args.geojson,
-                )
-            elif args.flight_number is not None:
-                add_flight_number(*args.flight_number, geojson=args.geojson)
-            elif args.pkpasses:
-                add_flight_pkpasses(geojson=args.geojson)
-    elif args.command == "index":
-        if args.entity == "airports":
-            index_airports(args.year, args.output)
-        elif args.entity == "tails":
-            index_tails()
-    elif args.command == "show":
-        if args.entity == "airport":
-            show_airport(args.id)
-        elif args.entity == "tail":
-            show_tail(args.tail_number)
-    elif args.command == "refresh":
-        if args.entity == "routes":
-            refresh_routes()
-    elif args.command == "report":
-        if args.entity == "milestones":
-            report.report_milestones()
-
 def add_flight_bcbp(bcbp_str, geojson: Path | None = None) -> None:
     """Parses a Bar-Coded Boarding Pass string."""
     bp = BoardingPass(bcbp_str)
     _add_bp_flights(bp, geojson=geojson)
-    refresh_routes()
+    refresh_routes(rebuild=False)
 
 def add_flight_fa_flight_id(
     fa_flight_id: str,
@@ -206,7 +29,7 @@ def add_flight_fa_flight_id(
     """Gets info for a fa_flight_id and saves flight to log."""
     fa_flights = aero.get_flights_ident(fa_flight_id, "fa_flight_id")
     _add_fa_flight_results(fa_flights)
-    refresh_routes()
+    refresh_routes(rebuild=False)
 
 def add_flight_number(
     airline_code: str,
@@ -227,7 +50,7 @@ def add_flight_number(
         fields={'airline_fid': airline.fid},
         geojson=geojson,
     )
-    refresh_routes()
+    refresh_routes(rebuild=False)
 
 def add_flight_pkpasses(geojson: Path | None = None) -> None:
     """Imports digital boarding passes."""
@@ -254,10 +77,15 @@ def add_flight_pkpasses(geojson: Path | None = None) -> None:
         )
 
     print(f"Importing digital boarding passes from \"{import_folder}\"")
-    pkpasses = {
-        f: PKPass(f) for f in import_folder.glob("*.pkpass")
-        if f.is_file()
-    }
+    pkpass_files = [
+        f for f in import_folder.glob("*.pkpass") if f.is_file()
+    ]
+    # Read passes concurrently, since loading each one is mostly
+    # spent reading and decompressing its file.
+    with ThreadPoolExecutor() as executor:
+        pkpasses = dict(
+            zip(pkpass_files, executor.map(PKPass, pkpass_files))
+        )
     if len(pkpasses) == 0:
         print("⚠️ No .pkpass files found.")
 
@@ -279,7 +107,7 @@ def add_flight_pkpasses(geojson: Path | None = None) -> None:
         archive_file_path = archive_folder / pkpass.archive_filename
         pkpass_file.move(archive_file_path)
         print(f"Archived PKPass to \"{archive_file_path}\"")
-    refresh_routes()
+    refresh_routes(rebuild=False)
 
 def index_airports(
     year: int | None = None,
@@ -372,9 +200,13 @@ def show_tail(tail_number: str) -> None:
         sys.exit(0)
     print(fl.flights_table(flights_gdf))
 
-def refresh_routes() -> None:
+def refresh_routes(rebuild: bool = True) -> None:
     """Refreshes the routes table."""
-    fl.refresh_routes()
+    fl.refresh_routes(rebuild=rebuild)
+
+def report_milestones() -> None:
+    """Reports flying milestones."""
+    report.report_milestones()
 
 def _add_bp_flights(bp: BoardingPass, geojson: Path | None = None) -> None:
     """Builds Flights from a BoardingPass, and saves them."""
@@ -407,8 +239,7 @@ def _add_bp_flights(bp: BoardingPass, geojson: Path | None = None) -> None:
 
     # Save flights.
     if geojson is None:
-        for flight in bp_flights:
-            flight.save()
+        fl.Flight.save_all(bp_flights)
     else:
         if len(bp_flights) == 1:
             bp_flights[0].save(geojson=geojson)
@@ -442,7 +273,21 @@ def _flight_from_aeroapi_results(aero_results) -> fl.Flight:
     if aero_flight_info is None:
         # No AeroAPI flight selected. Return empty flight.
         return fl.Flight()
-    flight = fl.Flight.from_aeroapi(aero_flight_info)
-    flight.exit_if_not_complete()
-    flight.fetch_aeroapi_track_geometry()
+
+    # For complete flights, start fetching the track while the flight's
+    # airports, airline, and aircraft are looked up.
+    fa_flight_id = aero_flight_info.get('fa_flight_id')
+    if aero_flight_info.get('progress_percent') != 100 or fa_flight_id is None:
+        flight = fl.Flight.from_aeroapi(aero_flight_info)
+        flight.exit_if_not_complete()
+        flight.fetch_aeroapi_track_geometry()
+        return flight
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        track_future = executor.submit(
+            aero.get_flights_ident_track,
+            fa_flight_id,
+            complete=True,
+        )
+        flight = fl.Flight.from_aeroapi(aero_flight_info)
+        flight.set_aeroapi_track_geometry(track_future.result())
     return flight